@@ -1,60 +1,33 @@
-import json
-import os
-import time
-from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+from collections import deque
+from concurrent.futures import Future
+from datetime import date
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
 
-import requests
-from dotenv import load_dotenv
-
-load_dotenv()
-
-BASE_URL = "https://api-seller.ozon.ru"
-TIMEOUT_SEC = 30
-
-CLIENT_ID = os.getenv("OZON_CLIENT_ID")
-API_KEY = os.getenv("OZON_API_KEY")
-if not CLIENT_ID or not API_KEY:
-    raise RuntimeError("В .env не найдены OZON_CLIENT_ID и/или OZON_API_KEY")
-
-HEADERS = {
-    "Client-Id": CLIENT_ID,
-    "Api-Key": API_KEY,
-    "Content-Type": "application/json",
-    "Accept": "application/json",
-}
+from ozon_client import OzonClient, json_dumps_indent, json_loads, write_file_bg
 
 # Для справочника складов FBO (чтобы маппить warehouse_id -> name)
 SUPPLY_TYPES = ["DIRECT", "CROSSDOCK"]
 
+# Справочник складов меняется редко: держим его в памяти процесса и в файле на текущие сутки
+WAREHOUSE_MAP_CACHE_PATH = "warehouse_map.json"
+_warehouse_map_cache: Optional[Dict[str, str]] = None
 
-def dump_json(path: str, obj: Any) -> None:
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(obj, f, ensure_ascii=False, indent=2)
+# Записи файлов, отданные фоновому потоку ozon_client; ждём их в flush_writes()
+_pending_writes: List["Future[None]"] = []
 
 
-def post_ozon(path: str, payload: Dict[str, Any], retries: int = 6) -> Any:
-    url = f"{BASE_URL}{path}"
-    backoff = 1.0
-
-    for _ in range(retries):
-        resp = requests.post(url, headers=HEADERS, json=payload, timeout=TIMEOUT_SEC)
-
-        if resp.status_code in (429, 500, 502, 503, 504):
-            time.sleep(backoff)
-            backoff = min(backoff * 2, 30)
-            continue
-
-        try:
-            data = resp.json()
-        except Exception:
-            data = resp.text
-
-        if not resp.ok:
-            raise RuntimeError(f"HTTP {resp.status_code} {path}: {data}")
+def dump_json(path: str, obj: Any) -> None:
+    """
+    Сериализуем сразу (obj дальше можно менять), а запись на диск отдаём фоновому потоку.
+    Дождаться записи и увидеть её ошибки — flush_writes().
+    """
+    _pending_writes.append(write_file_bg(path, json_dumps_indent(obj)))
 
-        return data
 
-    raise RuntimeError(f"Не удалось выполнить запрос {path} после {retries} попыток")
+async def flush_writes() -> None:
+    while _pending_writes:
+        await asyncio.wrap_future(_pending_writes.pop(0))
 
 
 def _is_list_of_dicts(x: Any) -> bool:
@@ -67,19 +40,26 @@ def find_best_list_of_dicts(obj: Any) -> Tuple[List[Dict[str, Any]], str]:
     best_path = ""
     priority_keys = ("clusters", "items", "result", "data")
 
-    def walk(node: Any, path: str) -> None:
-        nonlocal best, best_path
+    # обход в глубину явным стеком вместо рекурсии; детей кладём в обратном порядке,
+    # чтобы порядок обхода (и выбор при равной длине) был как у рекурсивной версии
+    stack: Deque[Tuple[Any, str]] = deque([(obj, "")])
+    while stack:
+        node, path = stack.pop()
 
         if isinstance(node, dict):
             for k in priority_keys:
-                if k in node and _is_list_of_dicts(node[k]):
-                    cand = node[k]
-                    if len(cand) > len(best):
-                        best = cand
-                        best_path = f"{path}.{k}" if path else k
+                cand = node.get(k)
+                if _is_list_of_dicts(cand) and len(cand) > len(best):
+                    best = cand
+                    best_path = f"{path}.{k}" if path else k
 
-            for k, v in node.items():
-                walk(v, f"{path}.{k}" if path else k)
+            # обычный ответ /v1/cluster/list: кластеры лежат прямо в clusters/result — глубже не лезем
+            if node is obj and best:
+                break
+
+            for k, v in reversed(node.items()):
+                if isinstance(v, (dict, list)):
+                    stack.append((v, f"{path}.{k}" if path else k))
 
         elif isinstance(node, list):
             if _is_list_of_dicts(node):
@@ -87,10 +67,10 @@ def find_best_list_of_dicts(obj: Any) -> Tuple[List[Dict[str, Any]], str]:
                     best = node
                     best_path = path or "<root_list>"
             else:
-                for i, v in enumerate(node):
-                    walk(v, f"{path}[{i}]")
+                for i in range(len(node) - 1, -1, -1):
+                    if isinstance(node[i], (dict, list)):
+                        stack.append((node[i], f"{path}[{i}]"))
 
-    walk(obj, "")
     return best, best_path
 
 
@@ -102,8 +82,8 @@ def pick(d: Dict[str, Any], *keys: str) -> Optional[Any]:
 
 
 # ---------- 1) Кластеры ----------
-def extract_clusters() -> List[Dict[str, Any]]:
-    data = post_ozon("/v1/cluster/list", {"cluster_type": "CLUSTER_TYPE_OZON"})
+async def extract_clusters(client: OzonClient) -> List[Dict[str, Any]]:
+    data = await client.post("/v1/cluster/list", {"cluster_type": "CLUSTER_TYPE_OZON"})
     dump_json("ozon_cluster_list_raw.json", data)
 
     clusters, path = find_best_list_of_dicts(data)
@@ -135,14 +115,14 @@ def extract_list_any(data: Any) -> List[Dict[str, Any]]:
     return []
 
 
-def get_fbo_warehouse_map() -> Dict[str, str]:
+async def fetch_fbo_warehouse_map(client: OzonClient) -> Dict[str, str]:
     """
     Пытаемся получить warehouse_id -> name.
     Если эндпойнт недоступен/ругается — вернём пустую мапу (склады будем брать из cluster/list, если там есть имена).
     """
     try:
         payload = {"filter_by_supply_type": SUPPLY_TYPES, "limit": 1000, "offset": 0}
-        data = post_ozon("/v1/warehouse/fbo/list", payload)
+        data = await client.post("/v1/warehouse/fbo/list", payload)
 
         rows = extract_list_any(data)
         mp: Dict[str, str] = {}
@@ -156,49 +136,115 @@ def get_fbo_warehouse_map() -> Dict[str, str]:
         return {}
 
 
+def load_warehouse_map_cache() -> Optional[Dict[str, str]]:
+    """Мапа из WAREHOUSE_MAP_CACHE_PATH, если файл записан сегодня, иначе None."""
+    try:
+        with open(WAREHOUSE_MAP_CACHE_PATH, "rb") as f:
+            cached = json_loads(f.read())
+    except (OSError, ValueError):
+        return None
+
+    if not isinstance(cached, dict) or cached.get("date") != date.today().isoformat():
+        return None
+    mp = cached.get("map")
+    return mp if isinstance(mp, dict) else None
+
+
+async def get_fbo_warehouse_map(client: OzonClient) -> Dict[str, str]:
+    """
+    fetch_fbo_warehouse_map с кэшем: повторные вызовы в том же процессе и повторные запуски
+    в те же сутки в API не ходят. Пустую мапу (эндпойнт ругнулся) не кэшируем.
+    """
+    global _warehouse_map_cache
+
+    if _warehouse_map_cache is None:
+        mp = load_warehouse_map_cache()
+        if mp is None:
+            mp = await fetch_fbo_warehouse_map(client)
+            if mp:
+                dump_json(WAREHOUSE_MAP_CACHE_PATH, {"date": date.today().isoformat(), "map": mp})
+        if not mp:
+            return {}
+        _warehouse_map_cache = mp
+
+    # отдаём копию, чтобы вызывающий код не испортил кэш
+    return dict(_warehouse_map_cache)
+
+
 # ---------- 3) Рекурсивно вытащить склады из кластера ----------
-def collect_warehouse_refs(node: Any) -> List[Tuple[Optional[str], Optional[str]]]:
+# Ключи, под которыми в ответах Ozon лежат списки складов (в /v1/cluster/list — logistic_clusters[].warehouses)
+_WAREHOUSE_KEYS = frozenset({
+    "warehouses",
+    "warehouse_ids",
+    "warehouse_list",
+    "warehouseIds",
+    "warehouseList",
+})
+
+
+def collect_warehouse_refs(
+    node: Any,
+    warehouse_map: Optional[Dict[str, str]] = None,
+    seen: Optional[Set[str]] = None,
+) -> List[Tuple[Optional[str], Optional[str]]]:
     """
     Возвращает список (warehouse_id, warehouse_name).
-    Ищет внутри структуры любые списки, где ключ содержит 'warehouse'.
+    Ищет внутри структуры списки под ключами из _WAREHOUSE_KEYS.
     Поддерживает:
       - список словарей (там может быть warehouse_id/name)
       - список id (int/str)
+
+    Если передан warehouse_map — пустые имена добираем из справочника fbo/list,
+    а склады, для которых имени так и нет, пропускаем.
+    Если передан seen — пропускаем склады, уже лежащие в seen (по id, без id — по имени),
+    и дописываем туда новые.
     """
     out: List[Tuple[Optional[str], Optional[str]]] = []
 
-    def add_from_list(lst: list) -> None:
-        # список словарей
-        if lst and all(isinstance(x, dict) for x in lst):
-            for w in lst:
-                wid = pick(w, "warehouse_id", "id", "warehouseId")
-                nm = pick(w, "name", "warehouse_name", "title", "warehouseName")
-                out.append((str(wid) if wid is not None else None, str(nm) if nm is not None else None))
-            return
-
-        # список id
-        if lst and all(isinstance(x, (int, str)) for x in lst):
-            for x in lst:
-                out.append((str(x), None))
-            return
-
-        # смешанный — рекурсивно
-        for x in lst:
-            walk(x)
-
-    def walk(x: Any) -> None:
-        if isinstance(x, dict):
-            for k, v in x.items():
-                lk = str(k).lower()
-                if "warehouse" in lk and isinstance(v, list):
-                    add_from_list(v)
-                else:
-                    walk(v)
+    # явный стек вместо рекурсии: (узел, это список под ключом из _WAREHOUSE_KEYS).
+    # Детей кладём в обратном порядке — порядок out как у рекурсивного обхода
+    stack: Deque[Tuple[Any, bool]] = deque([(node, False)])
+    while stack:
+        x, is_warehouse_list = stack.pop()
+
+        if is_warehouse_list:
+            # список словарей (там может быть warehouse_id/name)
+            if x and all(isinstance(i, dict) for i in x):
+                refs = []
+                for w in x:
+                    wid = pick(w, "warehouse_id", "id", "warehouseId")
+                    nm = pick(w, "name", "warehouse_name", "title", "warehouseName")
+                    refs.append((str(wid) if wid is not None else None, str(nm) if nm is not None else None))
+
+            # список id
+            elif x and all(isinstance(i, (int, str)) for i in x):
+                refs = [(str(i), None) for i in x]
+
+            # смешанный — обходим элементы как обычные узлы
+            else:
+                stack.extend((i, False) for i in reversed(x))
+                continue
+
+            for wid, nm in refs:
+                if warehouse_map is not None:
+                    if not nm and wid is not None:
+                        nm = warehouse_map.get(wid, nm)
+                    if not nm:
+                        continue
+                if seen is not None:
+                    key = wid or nm
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                out.append((wid, nm))
+
+        elif isinstance(x, dict):
+            for k, v in reversed(x.items()):
+                stack.append((v, k in _WAREHOUSE_KEYS and isinstance(v, list)))
+
         elif isinstance(x, list):
-            for i in x:
-                walk(i)
+            stack.extend((i, False) for i in reversed(x))
 
-    walk(node)
     return out
 
 
@@ -248,7 +294,7 @@ def build_warehouses(
       idРегион = локальный id региона
     """
     rows: List[Dict[str, Any]] = []
-    seen = set()  # (region_id, warehouse_id or name)
+    seen_by_region: Dict[int, Set[str]] = {}  # region_id -> {warehouse_id or name}
 
     for c in clusters:
         cid = pick(c, "cluster_id", "id")
@@ -258,22 +304,11 @@ def build_warehouses(
         if rid is None:
             continue
 
-        refs = collect_warehouse_refs(c)
+        # имена добираются по справочнику fbo/list, склады без имени (ты просишь "Склад" текстом)
+        # и повторы внутри региона отсекаются прямо в обходе
+        refs = collect_warehouse_refs(c, warehouse_map, seen_by_region.setdefault(rid, set()))
 
         for wid, nm in refs:
-            # если имени нет — попробуем по справочнику fbo/list
-            if (nm is None or nm == "") and wid is not None and wid in warehouse_map:
-                nm = warehouse_map[wid]
-
-            if not nm:
-                # если имени нет вообще — пропускаем (ты просишь "Склад" текстом)
-                continue
-
-            key = (rid, wid or nm)
-            if key in seen:
-                continue
-            seen.add(key)
-
             rows.append({
                 "id": None,
                 "Склад": nm,
@@ -285,15 +320,20 @@ def build_warehouses(
     return rows
 
 
-def main() -> None:
-    clusters = extract_clusters()
-    warehouse_map = get_fbo_warehouse_map()
+async def main() -> None:
+    async with OzonClient(retries=6) as client:
+        # кластеры и справочник складов друг от друга не зависят — тянем параллельно
+        clusters, warehouse_map = await asyncio.gather(
+            extract_clusters(client),
+            get_fbo_warehouse_map(client),
+        )
 
     regions, map_cluster_to_region_id = build_regions(clusters)
     warehouses = build_warehouses(clusters, map_cluster_to_region_id, warehouse_map)
 
     dump_json("регионы_ozon.json", {"регион_ozon": regions})
     dump_json("склады_ozon.json", {"склады_ozon": warehouses})
+    await flush_writes()
 
     print(f"✅ Регионы: {len(regions)} -> регионы_ozon.json")
     print(f"✅ Склады: {len(warehouses)} -> склады_ozon.json")
@@ -302,4 +342,4 @@ def main() -> None:
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
@@ -0,0 +1,566 @@
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import islice
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Set, TypeVar
+
+import aiohttp
+from aiolimiter import AsyncLimiter
+from dotenv import load_dotenv
+
+try:
+    import orjson
+except ImportError:  # без orjson работаем на стандартном json, просто медленнее
+    orjson = None
+
+try:
+    import numpy as np
+except ImportError:  # без numpy объёмы считаем поштучно
+    np = None
+
+try:
+    # потоково разбираем только C-бэкендом: чистый Python в ijson в разы медленнее orjson
+    import ijson.backends.yajl2_c as ijson
+    from ijson.common import JSONError as IJSONError
+except ImportError:  # без ijson/yajl2_c большие ответы разбираем целиком
+    ijson = None
+
+load_dotenv()
+
+BASE_URL = "https://api-seller.ozon.ru"
+TIMEOUT_SEC = 30
+
+CLIENT_ID = os.getenv("OZON_CLIENT_ID")
+API_KEY = os.getenv("OZON_API_KEY")
+if not CLIENT_ID or not API_KEY:
+    raise RuntimeError("В .env не найдены OZON_CLIENT_ID и/или OZON_API_KEY")
+
+HEADERS = {
+    "Client-Id": CLIENT_ID,
+    "Api-Key": API_KEY,
+    "Content-Type": "application/json",
+    "Accept": "application/json",
+}
+
+# Сколько запросов к api-seller.ozon.ru держим в полёте одновременно
+MAX_CONNECTIONS_PER_HOST = 64
+
+# OZON Seller API пускает до 50 запросов в секунду на Client-Id — держимся чуть ниже,
+# чтобы не ловить 429 и не тратить время на backoff
+REQ_PER_SEC = 40
+
+# Сколько батчей (attributes, остатки) запрашиваем наперёд, пока вызывающий код разбирает предыдущие
+PREFETCH_BATCHES = 16
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Один фоновый поток на запись файлов: пока он пишет на диск, event loop продолжает ходить в API
+_IO_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="json-writer")
+# Сколько записей в файл может стоять в очереди у _IO_POOL: если диск медленнее API,
+# дальше ждём запись, а не копим батчи в памяти
+MAX_PENDING_WRITES = 4
+
+T = TypeVar("T")
+
+
+def json_dumps(obj: Any) -> bytes:
+    """Одна строка JSON без отступов — для построчной записи больших массивов."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+
+def json_dumps_indent(obj: Any) -> bytes:
+    """JSON с отступом в 2 пробела — для небольших файлов, которые смотрят глазами."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8")
+
+
+def json_loads(raw: Any) -> Any:
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def chunked(items: Iterable[Any], n: int) -> Iterator[List[Any]]:
+    # батчи отдаём по одному, а не собираем заранее список всех батчей.
+    # У списка берём срезы, любой другой iterable (генератор и т.п.) режем через islice
+    if isinstance(items, list):
+        for i in range(0, len(items), n):
+            yield items[i:i + n]
+        return
+
+    it = iter(items)
+    while True:
+        batch = list(islice(it, n))
+        if not batch:
+            return
+        yield batch
+
+
+def extract_items(data: Any) -> List[Dict[str, Any]]:
+    """
+    Список записей из ответа Ozon. Обычно это {"result": [ {...}, {...} ]}
+    (так отвечает /v4/product/info/attributes), но на всякий случай поддержим
+    и {"result":{"items":[...]}} / {"items":[...]} / просто [...]
+    """
+    if isinstance(data, list):
+        return [x for x in data if isinstance(x, dict)]
+    if not isinstance(data, dict):
+        return []
+    r = data.get("result")
+    if isinstance(r, list):
+        return [x for x in r if isinstance(x, dict)]
+    if isinstance(r, dict) and isinstance(r.get("items"), list):
+        return [x for x in r["items"] if isinstance(x, dict)]
+    if isinstance(data.get("items"), list):
+        return [x for x in data["items"] if isinstance(x, dict)]
+    return []
+
+
+# Делитель для перевода depth*width*height в м^3. Частые написания единиц ищем сразу,
+# без .lower().strip() на каждый товар
+_UNIT_DIV = {
+    "mm": 1_000_000_000.0,
+    "cm": 1_000_000.0,
+    "m": 1.0,
+    "MM": 1_000_000_000.0,
+    "CM": 1_000_000.0,
+    "M": 1.0,
+}
+
+
+def unit_divisor(unit: Any) -> float:
+    div = _UNIT_DIV.get(unit)
+    if div is None:
+        div = _UNIT_DIV.get((unit or "").lower().strip(), 1.0)
+    return div
+
+
+def _float_column(items: List[Dict[str, Any]], key: str) -> Any:
+    """Колонка габаритов батча как float64-массив (None -> nan) или None, если там что-то нечисловое."""
+    try:
+        col = np.array([it.get(key) for it in items], dtype=np.float64)
+    except (TypeError, ValueError):
+        return None
+    return col if col.shape == (len(items),) else None
+
+
+def calc_volumes_m3(
+    items: List[Dict[str, Any]],
+    calc_volume: Callable[[Any, Any, Any, str], Optional[float]],
+) -> List[Optional[float]]:
+    """
+    Объём в м^3 сразу для всего батча записей Ozon (depth/width/height/dimension_unit):
+    с numpy — одним векторным выражением, без numpy или при нечисловых габаритах —
+    поштучно через calc_volume скрипта.
+    """
+    if np is not None and items:
+        depth = _float_column(items, "depth")
+        width = _float_column(items, "width")
+        height = _float_column(items, "height")
+        if depth is not None and width is not None and height is not None:
+            divs = np.array([unit_divisor(it.get("dimension_unit") or "mm") for it in items], dtype=np.float64)
+            vol = depth * width * height / divs
+            # nan (не было какого-то из габаритов) -> None, как при поштучном расчёте
+            return [None if v != v else v for v in vol.tolist()]
+
+    return [
+        calc_volume(it.get("depth"), it.get("width"), it.get("height"), it.get("dimension_unit") or "mm")
+        for it in items
+    ]
+
+
+def attributes_payload(batch: List[str]) -> Dict[str, Any]:
+    return {
+        "filter": {
+            "product_id": batch,
+            "visibility": "ALL",
+        },
+        "limit": len(batch),
+        "sort_dir": "ASC",
+    }
+
+
+async def prefetch_ordered(aws: Iterable[Awaitable[T]], window: int = PREFETCH_BATCHES) -> AsyncIterator[T]:
+    """
+    Запускает корутины из aws наперёд (не больше window одновременно) и отдаёт их результаты
+    в исходном порядке. aws лучше передавать генератором — тогда корутины создаются по мере надобности.
+    """
+    aws = iter(aws)
+    pending: Deque["asyncio.Future[T]"] = deque()
+
+    try:
+        while True:
+            while len(pending) < window:
+                aw = next(aws, None)
+                if aw is None:
+                    break
+                pending.append(asyncio.ensure_future(aw))
+            if not pending:
+                break
+
+            yield await pending.popleft()
+    finally:
+        for fut in pending:
+            fut.cancel()
+
+
+def _write_file(path: str, data: bytes) -> None:
+    # файл уже целиком сериализован: пишем без буфера Python, обычно одним write
+    view = memoryview(data)
+    with open(path, "wb", buffering=0) as f:
+        while view:
+            view = view[f.write(view):]
+
+
+def write_file_bg(path: str, data: bytes) -> "Future[None]":
+    """Записать готовые байты в path фоновым потоком _IO_POOL. Ошибки записи — в future.result()."""
+    return _IO_POOL.submit(_write_file, path, data)
+
+
+async def write_json_rows(
+    out_path: str,
+    key: str,
+    batches: AsyncIterator[Iterable[Dict[str, Any]]],
+) -> int:
+    """
+    Пишем {key: [...]} построчно, по мере прихода батчей строк — весь список в памяти не держим.
+    Сам write уходит в _IO_POOL, чтобы диск не тормозил следующие запросы. Возвращает число строк.
+    out_path появляется (или заменяется) только после записи закрывающей ]}.
+    """
+    # пишем во временный файл и подменяем out_path только целиком записанным JSON:
+    # при ошибке посреди выгрузки прежний файл остаётся как был
+    tmp_path = out_path + ".tmp"
+    count = 0
+    writes: Deque["asyncio.Future[Any]"] = deque()
+    try:
+        with open(tmp_path, "wb") as f:
+            async def write(data: bytes) -> None:
+                # очередь к диску ограничена: ждём самую старую запись (и видим её ошибку)
+                while len(writes) >= MAX_PENDING_WRITES:
+                    await writes.popleft()
+                writes.append(asyncio.wrap_future(_IO_POOL.submit(f.write, data)))
+
+            try:
+                await write(b"{" + json_dumps(key) + b": [\n")
+
+                async for rows in batches:
+                    parts: List[bytes] = []
+                    for row in rows:
+                        parts.append(b",\n  " if count else b"  ")
+                        parts.append(json_dumps(row))
+                        count += 1
+                    await write(b"".join(parts))
+
+                await write(b"\n]}\n")
+            finally:
+                # файл закрываем, только когда фоновый поток дописал всё отправленное
+                if writes:
+                    await asyncio.wait(writes)
+
+        for fut in writes:
+            fut.result()  # ошибки записи всплывают здесь
+        os.replace(tmp_path, out_path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+    return count
+
+
+def _header_float(headers: Any, name: str) -> Optional[float]:
+    try:
+        return float(headers[name])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _reset_seconds(headers: Any) -> Optional[float]:
+    """Через сколько секунд сбросится окно лимита по X-RateLimit-Reset (если заголовок есть)."""
+    reset = _header_float(headers, "X-RateLimit-Reset")
+    if reset is None:
+        return None
+    if reset > 1_000_000_000_000:
+        # пришёл unix timestamp в миллисекундах
+        reset = reset / 1000 - time.time()
+    elif reset > 1_000_000_000:
+        # пришёл unix timestamp, а не "через сколько секунд"
+        reset -= time.time()
+    return max(reset, 0.0)
+
+
+class OzonClient:
+    """
+    Общий асинхронный клиент OZON Seller API для всех скриптов выгрузки.
+
+    Держит на весь запуск одну aiohttp-сессию (keep-alive пул, заголовки авторизации),
+    лимит запросов в секунду и одновременных запросов (concurrency), повторы на 429/5xx:
+
+        async with OzonClient() as client:
+            data = await client.post("/v3/product/list", payload)
+    """
+
+    def __init__(self, retries: int = 5, debug: bool = False, concurrency: int = MAX_CONNECTIONS_PER_HOST) -> None:
+        self.retries = retries
+        self.debug = debug
+        self.concurrency = concurrency
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._limiter = AsyncLimiter(max_rate=REQ_PER_SEC, time_period=1)
+        self._semaphore = asyncio.Semaphore(concurrency)
+        # что известно из заголовков X-RateLimit-*: потолок по Limit (в запросах/сек) и
+        # временный потолок по Remaining, действующий до сброса текущего окна
+        self._limit_rate: Optional[float] = None
+        self._window_rate: Optional[float] = None
+        self._window_until = 0.0
+        # пути, где записи лежат не под prefix post_items — их разбираем целиком сразу
+        self._unstreamable_paths: Set[str] = set()
+
+    async def __aenter__(self) -> "OzonClient":
+        # сокеты ограничиваем и на хост, и на сессию целиком — чтобы не исчерпать их на стороне ОС
+        connector = aiohttp.TCPConnector(
+            limit=2 * self.concurrency,
+            limit_per_host=self.concurrency,
+            keepalive_timeout=60,
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            headers=HEADERS,
+            # как timeout= у requests: ограничиваем подключение и паузу между чтениями из сокета,
+            # а не весь запрос — большой ответ attributes читается (и разбирается) дольше 30 с
+            timeout=aiohttp.ClientTimeout(sock_connect=TIMEOUT_SEC, sock_read=TIMEOUT_SEC),
+        )
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _adjust_rate_limit(self, status: int, headers: Any) -> None:
+        """
+        Запоминаем, что OZON сообщил в X-RateLimit-*, и пересчитываем темп (_apply_rate_limit).
+
+        X-RateLimit-Limit — квота на окно; длину окна OZON не присылает, поэтому переводим квоту
+        в запросы/сек по X-RateLimit-Reset того же ответа (нет Reset — окно в секунду).
+        Каждый ответ пересчитывает потолок заново, так что один длинный Reset не залипает;
+        ответы 429 (там Reset — штрафная пауза, а не окно) потолок по Limit не трогают.
+        X-RateLimit-Remaining / X-RateLimit-Reset — временный потолок: оставшейся квоты
+        должно хватить до сброса окна (но не дольше 30 с), после сброса он снимается.
+        """
+        limit = _header_float(headers, "X-RateLimit-Limit")
+        remaining = _header_float(headers, "X-RateLimit-Remaining")
+        if limit is None and remaining is None:
+            return
+
+        reset = _reset_seconds(headers)
+        if limit is not None and limit > 0 and status != 429:
+            self._limit_rate = limit / max(reset or 1.0, 1.0)
+        if remaining is not None:
+            span = min(max(reset or 0.0, 1.0), 30.0)
+            self._window_rate = remaining / span
+            self._window_until = time.monotonic() + span
+
+        self._apply_rate_limit()
+
+    def _apply_rate_limit(self) -> None:
+        """
+        Темп = REQ_PER_SEC, урезанный потолком по Limit и (пока окно не сбросилось) по Remaining.
+        Лимитер не пересоздаём, а меняем ему скорость на месте: новый начинал бы с пустым ведром
+        и пропускал лишнюю пачку запросов ровно тогда, когда квоты мало.
+        """
+        rate = float(REQ_PER_SEC)
+        if self._limit_rate is not None:
+            rate = min(rate, self._limit_rate)
+        if self._window_rate is not None:
+            if time.monotonic() < self._window_until:
+                rate = min(rate, self._window_rate)
+            else:
+                self._window_rate = None
+        rate = max(1.0, rate)
+
+        limiter = self._limiter
+        if rate != limiter.max_rate:
+            # накопленный уровень досчитываем по старой скорости, дальше течёт по новой.
+            # _rate_per_sec — внутреннее поле aiolimiter, поэтому версия закреплена в requirements.txt
+            limiter.has_capacity()
+            limiter.max_rate = rate
+            limiter._rate_per_sec = rate / limiter.time_period
+
+    async def post(self, path: str, payload: Dict[str, Any], retries: Optional[int] = None) -> Any:
+        return await self._request(path, payload, retries, lambda resp: self._read_json(resp, path))
+
+    async def post_items(
+        self,
+        path: str,
+        payload: Dict[str, Any],
+        fields: Callable[[Dict[str, Any]], T],
+        prefix: str = "result.item",
+        retries: Optional[int] = None,
+    ) -> List[T]:
+        """
+        То же, что extract_items(post(...)), но массив записей разбирается из тела потоково (ijson):
+        весь ответ в память не поднимается, от каждой записи остаётся только fields(item).
+
+        Потоково ищем записи только под prefix. Если там пусто или тело не JSON (например,
+        HTML-страница прокси), запрос один раз повторяем с разбором целиком через extract_items
+        (он понимает и другие формы ответа), и дальше этот path сразу разбираем целиком —
+        так пустые ответы не стоят двух запросов каждый. Без ijson (yajl2_c) — всегда целиком.
+        """
+        if ijson is not None and path not in self._unstreamable_paths:
+            async def handle(resp: aiohttp.ClientResponse) -> List[T]:
+                if not resp.ok:
+                    await self._read_json(resp, path)  # поднимет RuntimeError с телом ответа
+                try:
+                    return [
+                        fields(it)
+                        async for it in ijson.items_async(resp.content, prefix, use_float=True)
+                        if isinstance(it, dict)
+                    ]
+                except IJSONError:
+                    return []
+
+            items = await self._request(path, payload, retries, handle)
+            if items:
+                return items
+            self._unstreamable_paths.add(path)
+
+        return [fields(it) for it in extract_items(await self.post(path, payload, retries))]
+
+    async def _read_json(self, resp: aiohttp.ClientResponse, path: str) -> Any:
+        # парсим байты тела напрямую, без промежуточного декодирования в str
+        raw = await resp.read()
+        try:
+            data = json_loads(raw)
+        except ValueError:
+            data = raw.decode("utf-8", errors="replace")
+
+        if self.debug:
+            print("\n=== RESPONSE ===")
+            print(f"status={resp.status}")
+            if isinstance(data, dict):
+                print(f"keys={list(data.keys())[:30]}")
+            else:
+                print(f"type={type(data)}")
+
+        if not resp.ok:
+            raise RuntimeError(f"HTTP {resp.status} {path}: {data}")
+
+        return data
+
+    async def _request(
+        self,
+        path: str,
+        payload: Dict[str, Any],
+        retries: Optional[int],
+        handle: Callable[[aiohttp.ClientResponse], Awaitable[T]],
+    ) -> T:
+        if self._session is None:
+            raise RuntimeError("OzonClient используется вне async with")
+
+        url = f"{BASE_URL}{path}"
+        retries = self.retries if retries is None else retries
+        backoff = 1.0
+
+        if self.debug:
+            print("\n=== REQUEST ===")
+            print(f"POST {url}")
+            print(f"payload={payload}")
+
+        last_error: Optional[BaseException] = None
+        for _ in range(retries):
+            self._apply_rate_limit()  # временный потолок по Remaining мог уже истечь
+            status: Optional[int] = None
+            reset: Optional[float] = None
+            try:
+                async with self._semaphore, self._limiter, self._session.post(url, json=payload) as resp:
+                    self._adjust_rate_limit(resp.status, resp.headers)
+                    status = resp.status
+                    reset = _reset_seconds(resp.headers)
+
+                    if resp.status not in RETRY_STATUSES:
+                        return await handle(resp)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                # обрыв keep-alive соединения, таймаут сокета, недочитанное тело — повторяем, как 5xx
+                last_error = e
+                if self.debug:
+                    print(f"\n=== TRANSPORT ERROR ===\n{path}: {e!r}")
+
+            # соединение уже отпущено, ждём и пробуем снова:
+            # на 429 — ровно до сброса окна лимита, если OZON его сообщил; на 5xx и сетевые ошибки — экспоненциально
+            if status == 429 and reset is not None:
+                await asyncio.sleep(min(max(reset, 0.1), 30))
+                continue
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+
+        raise RuntimeError(f"Не удалось выполнить запрос {path} после {retries} попыток") from last_error
+
+    async def get_all_product_ids(self) -> List[str]:
+        """
+        Постранично проходим /v3/product/list по курсору last_id.
+        Как только курсор следующей страницы известен, запрос за ней уходит сразу —
+        разбор текущей страницы идёт, пока следующая уже в пути.
+        Дубли (страницы могут пересечься на границе) отбрасываем, порядок первого появления сохраняем.
+        """
+        # dict как упорядоченное множество: update() добавляет только новые ключи, уже
+        # встреченные остаются на своём месте
+        product_ids: Dict[str, None] = {}
+
+        def fetch_page(last_id: str) -> "asyncio.Future[Any]":
+            payload = {"filter": {"visibility": "ALL"}, "last_id": last_id, "limit": 1000}
+            return asyncio.ensure_future(self.post("/v3/product/list", payload))
+
+        next_page: Optional["asyncio.Future[Any]"] = fetch_page("")
+        try:
+            while next_page is not None:
+                data = await next_page
+                next_page = None
+
+                if not isinstance(data, dict):
+                    break
+                result = data.get("result") or {}
+                items = result.get("items") or []
+                if not items:
+                    break
+
+                last_id = str(result.get("last_id") or "")
+                if last_id != "":
+                    next_page = fetch_page(last_id)
+
+                # product_id обычно приходит числом; если уже строка — не пересоздаём её
+                product_ids.update(dict.fromkeys([
+                    pid if type(pid) is str else str(pid)
+                    for pid in [it.get("product_id") for it in items]
+                    if pid is not None
+                ]))
+        finally:
+            if next_page is not None:
+                next_page.cancel()
+
+        return list(product_ids)
+
+    async def iter_attributes(self, product_ids: List[str]) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Отдаёт /v4/product/info/attributes батчами (по 1000 товаров) в исходном порядке,
+        по мере прихода ответов. Вперёд держим не больше PREFETCH_BATCHES запросов —
+        так в памяти лежат только ближайшие батчи, а не весь каталог.
+        """
+        responses = prefetch_ordered(
+            self.post("/v4/product/info/attributes", attributes_payload(batch))
+            for batch in chunked(product_ids, 1000)
+        )
+        async for data in responses:
+            items = extract_items(data)
+
+            if self.debug and items:
+                print(f"attributes example keys={list(items[0].keys())}")
+
+            yield items
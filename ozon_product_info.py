@@ -1,75 +1,19 @@
-import json
-import os
-import time
-from typing import Any, Dict, List, Optional
+import asyncio
+from typing import Any, AsyncIterator, Dict, List, Optional
 
-import requests
-from dotenv import load_dotenv
-
-load_dotenv()
-
-BASE_URL = "https://api-seller.ozon.ru"
-TIMEOUT_SEC = 30
-
-CLIENT_ID = os.getenv("OZON_CLIENT_ID")
-API_KEY = os.getenv("OZON_API_KEY")
-if not CLIENT_ID or not API_KEY:
-    raise RuntimeError("В .env не найдены OZON_CLIENT_ID и/или OZON_API_KEY")
-
-HEADERS = {
-    "Client-Id": CLIENT_ID,
-    "Api-Key": API_KEY,
-    "Content-Type": "application/json",
-    "Accept": "application/json",
-}
-
-
-def post_ozon(path: str, payload: Dict[str, Any], retries: int = 5, debug: bool = False) -> Any:
-    url = f"{BASE_URL}{path}"
-    backoff = 1.0
-
-    if debug:
-        print("\n=== REQUEST ===")
-        print(f"POST {url}")
-        print(f"payload={payload}")
-
-    for _ in range(retries):
-        resp = requests.post(url, headers=HEADERS, json=payload, timeout=TIMEOUT_SEC)
-
-        if resp.status_code in (429, 500, 502, 503, 504):
-            time.sleep(backoff)
-            backoff = min(backoff * 2, 30)
-            continue
-
-        try:
-            data = resp.json()
-        except Exception:
-            data = resp.text
-
-        if debug:
-            print("\n=== RESPONSE ===")
-            print(f"status={resp.status_code}")
-            if isinstance(data, dict):
-                print(f"keys={list(data.keys())[:30]}")
-            else:
-                print(f"type={type(data)}")
-
-        if not resp.ok:
-            raise RuntimeError(f"HTTP {resp.status_code} {path}: {data}")
-
-        return data
-
-    raise RuntimeError(f"Не удалось выполнить запрос {path} после {retries} попыток")
-
-
-def chunked(lst: List[str], n: int) -> List[List[str]]:
-    return [lst[i:i + n] for i in range(0, len(lst), n)]
+from ozon_client import OzonClient, calc_volumes_m3, unit_divisor, write_json_rows
 
 
 def to_int_safe(v: Any) -> Optional[int]:
+    # Ozon почти всегда присылает габариты/вес уже нужным типом — его отдаём как есть,
+    # а на мусор (строки, списки) ловим только ошибки конвертации
+    if v is None:
+        return None
+    if type(v) is int:
+        return v
     try:
-        return int(v) if v is not None else None
-    except Exception:
+        return int(v)
+    except (TypeError, ValueError, OverflowError):
         return None
 
 
@@ -88,178 +32,123 @@ def calc_volume(depth: Any, width: Any, height: Any, unit: str) -> Optional[floa
     except Exception:
         return None
 
-    u = (unit or "").lower().strip()
-    v = d * w * h
-    if u == "mm":
-        return v / 1_000_000_000.0
-    if u == "cm":
-        return v / 1_000_000.0
-    if u == "m":
-        return v
-    return v
-
-
-def extract_result_list(data: Any) -> List[Dict[str, Any]]:
+    return d * w * h / unit_divisor(unit)
+
+
+# Шаблон строки характеристик: все колонки таблицы в нужном порядке, по умолчанию null.
+# characteristics_row копирует его и заполняет только поля, которые есть в ответе Ozon.
+_ROW_TEMPLATE: Dict[str, Any] = dict.fromkeys([
+    "id",
+    "idtow",
+    "SKU",
+    "Длина упаковки",
+    "Ширина упаковки",
+    "Высота упаковки",
+    "Вес с упаковкой",
+    "weight_unit",
+    "ставка НДС",  # пока нет в этом ответе
+    "idкатегории_товара_oz",
+    "Наименование товара",
+    "Бренд",
+    "Наименование модели (Склейка)",
+    "Кол-во шт",
+    "Вес самого товара",
+    "Кол-во товара в УЕИ",
+    "#",
+    "Аннотация",
+    "Названия группы",
+    "PartNumber",
+    'Длина "Лента"',
+    'Ширина "Лента"',
+    "Крепелние",
+    "Цвет",
+    "Материал",
+    "Вид техники",
+    "Вид выпуска товара",
+    "Страна изготовитель",
+    "Кол-во зав. упаковок",
+    "ТН ВЭД коды ЕАЭС",
+    "ОЕМ-номер",
+    "Алтер. артикул",
+    "Вид ламп",
+    'Типоразмер "Цоколь"',
+    "Кол-во ламп",
+    "Назначение авто. лампы",
+    "Питание",
+    'Мощность "лампы"',
+    "Комплектация упаковки",
+    "Вид запчасти",
+    "Сторона установки",
+    "Вид спец. техники",
+    "Кратность покупки",
+    "Класс опасности товара",
+    "Место установки",
+    "Объем_м3",
+    "dimension_unit",
+])
+
+
+def characteristics_row(it: Dict[str, Any], volume_m3: Optional[float]) -> Dict[str, Any]:
     """
-    У тебя /v4/product/info/attributes приходит так:
-    {"result": [ {...}, {...} ]}
-
-    На всякий случай поддержим ещё:
-    {"result":{"items":[...]}} / {"items":[...]} / просто [...]
+    Строка "большого" JSON под твою таблицу.
+    Поля, которых нет в ответе Ozon прямо сейчас, оставляем null.
     """
-    if isinstance(data, list):
-        return [x for x in data if isinstance(x, dict)]
-    if not isinstance(data, dict):
-        return []
-    r = data.get("result")
-    if isinstance(r, list):
-        return [x for x in r if isinstance(x, dict)]
-    if isinstance(r, dict) and isinstance(r.get("items"), list):
-        return [x for x in r["items"] if isinstance(x, dict)]
-    if isinstance(data.get("items"), list):
-        return [x for x in data["items"] if isinstance(x, dict)]
-    return []
-
-
-def get_all_product_ids() -> List[str]:
-    product_ids: List[str] = []
-    last_id: str = ""
-
-    while True:
-        payload = {"filter": {"visibility": "ALL"}, "last_id": last_id, "limit": 1000}
-        data = post_ozon("/v3/product/list", payload)
-
-        if not isinstance(data, dict):
-            break
-        result = data.get("result") or {}
-        items = result.get("items") or []
-        if not items:
-            break
+    depth = it.get("depth")          # Длина упаковки = depth
+    width = it.get("width")
+    height = it.get("height")
+    dim_unit = it.get("dimension_unit") or "mm"
 
-        for it in items:
-            pid = it.get("product_id")
-            if pid is not None:
-                product_ids.append(str(pid))
+    # id в БД автогенерится — остаётся None из шаблона
+    row = _ROW_TEMPLATE.copy()
 
-        last_id = str(result.get("last_id") or "")
-        if last_id == "":
-            break
+    row["idtow"] = it.get("id")  # product_id из Ozon (по твоему примеру "id")
+    row["SKU"] = it.get("sku")   # если поле есть — будет, если нет — останется null
 
-    return product_ids
+    row["Длина упаковки"] = to_int_safe(depth)
+    row["Ширина упаковки"] = to_int_safe(width)
+    row["Высота упаковки"] = to_int_safe(height)
 
+    row["Вес с упаковкой"] = to_int_safe(it.get("weight"))
+    row["weight_unit"] = it.get("weight_unit")
 
-def get_attributes(product_ids: List[str], debug: bool = False) -> List[Dict[str, Any]]:
-    all_items: List[Dict[str, Any]] = []
+    row["idкатегории_товара_oz"] = it.get("description_category_id")
+    row["Наименование товара"] = it.get("name")
+    row["PartNumber"] = it.get("offer_id")  # ты пометила PartNumber как артикул
 
-    for batch in chunked(product_ids, 1000):
-        payload = {
-            "filter": {
-                "product_id": batch,
-                "visibility": "ALL",
-            },
-            "limit": len(batch),
-            "sort_dir": "ASC",
-        }
+    # Дополнительно: объём (ты просила считать)
+    row["Объем_м3"] = volume_m3
+    row["dimension_unit"] = dim_unit
 
-        data = post_ozon("/v4/product/info/attributes", payload, debug=debug)
-        items = extract_result_list(data)
+    return row
 
-        if debug and items:
-            print(f"attributes items[0].keys()={list(items[0].keys())}")
 
-        all_items.extend(items)
-
-    return all_items
-
-
-def export_characteristics_ozon(items: List[Dict[str, Any]], out_path: str = "характеристики_ozon.json") -> None:
+async def export_characteristics_ozon(
+    batches: AsyncIterator[List[Dict[str, Any]]],
+    out_path: str = "характеристики_ozon.json",
+) -> int:
     """
-    Формируем "большой" JSON под твою таблицу.
-    Поля, которых нет в ответе Ozon прямо сейчас, оставляем null.
+    Пишем {"характеристики_ozon": [...]} построчно, по мере прихода батчей —
+    весь список строк в памяти не держим. Возвращает число записанных строк.
     """
-    rows: List[Dict[str, Any]] = []
-
-    for it in items:
-        depth = it.get("depth")          # Длина упаковки = depth
-        width = it.get("width")
-        height = it.get("height")
-        dim_unit = it.get("dimension_unit") or "mm"
-
-        row = {
-            # id в БД автогенерится — в JSON можем не писать (или оставить None)
-            "id": None,
-
-            "idtow": it.get("id"),  # product_id из Ozon (по твоему примеру "id")
-            "SKU": it.get("sku"),   # если поле есть — будет, если нет — останется null
-
-            "Длина упаковки": to_int_safe(depth),
-            "Ширина упаковки": to_int_safe(width),
-            "Высота упаковки": to_int_safe(height),
-
-            "Вес с упаковкой": to_int_safe(it.get("weight")),
-            "weight_unit": it.get("weight_unit"),
-
-            "ставка НДС": None,  # пока нет в этом ответе
-            "idкатегории_товара_oz": it.get("description_category_id"),
-
-            "Наименование товара": it.get("name"),
-            "Бренд": None,
-            "Наименование модели (Склейка)": None,
-            "Кол-во шт": None,
-            "Вес самого товара": None,
-            "Кол-во товара в УЕИ": None,
-            "#": None,
-            "Аннотация": None,
-            "Названия группы": None,
-            "PartNumber": it.get("offer_id"),  # ты пометила PartNumber как артикул
-            'Длина "Лента"': None,
-            'Ширина "Лента"': None,
-            "Крепелние": None,
-            "Цвет": None,
-            "Материал": None,
-            "Вид техники": None,
-            "Вид выпуска товара": None,
-            "Страна изготовитель": None,
-            "Кол-во зав. упаковок": None,
-            "ТН ВЭД коды ЕАЭС": None,
-            "ОЕМ-номер": None,
-            "Алтер. артикул": None,
-            "Вид ламп": None,
-            'Типоразмер "Цоколь"': None,
-            "Кол-во ламп": None,
-            "Назначение авто. лампы": None,
-            "Питание": None,
-            'Мощность "лампы"': None,
-            "Комплектация упаковки": None,
-            "Вид запчасти": None,
-            "Сторона установки": None,
-            "Вид спец. техники": None,
-            "Кратность покупки": None,
-            "Класс опасности товара": None,
-            "Место установки": None,
-
-            # Дополнительно: объём (ты просила считать)
-            "Объем_м3": calc_volume(depth, width, height, dim_unit),
-            "dimension_unit": dim_unit,
-        }
-
-        rows.append(row)
-
-    with open(out_path, "w", encoding="utf-8") as f:
-        json.dump({"характеристики_ozon": rows}, f, ensure_ascii=False, indent=2)
-
-    print(f"✅ Сохранено: {len(rows)} строк → {out_path}")
+    count = await write_json_rows(out_path, "характеристики_ozon", (
+        [characteristics_row(it, volume_m3) for it, volume_m3 in zip(items, calc_volumes_m3(items, calc_volume))]
+        async for items in batches
+    ))
 
+    print(f"✅ Сохранено: {count} строк → {out_path}")
+    return count
 
-def main(debug: bool = False) -> None:
-    product_ids = get_all_product_ids()
-    print(f"Найдено товаров: {len(product_ids)}")
 
-    items = get_attributes(product_ids, debug=debug)
-    print(f"Получено записей attributes: {len(items)}")
+async def main(debug: bool = False) -> None:
+    async with OzonClient(debug=debug) as client:
+        product_ids = await client.get_all_product_ids()
+        print(f"Найдено товаров: {len(product_ids)}")
 
-    export_characteristics_ozon(items, "характеристики_ozon.json")
+        await export_characteristics_ozon(
+            client.iter_attributes(product_ids),
+            "характеристики_ozon.json",
+        )
 
 
 if __name__ == "__main__":
-    main(debug=False)
+    asyncio.run(main(debug=False))
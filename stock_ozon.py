@@ -1,108 +1,39 @@
-import json
-import os
-import time
-from typing import Any, Dict, List, Optional, Tuple
+import argparse
+import asyncio
+import hashlib
+from datetime import date
+from functools import lru_cache
+from itertools import groupby
+from operator import itemgetter
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
 
-import requests
-from dotenv import load_dotenv
+from ozon_client import OzonClient, attributes_payload, chunked, json_dumps, json_loads, prefetch_ordered
 
-load_dotenv()
+# Одновременных запросов к OZON из этого скрипта: остатки идут мелкими чанками по 99 SKU,
+# и на большем числе параллельных запросов /v1/analytics/stocks начинает отвечать 429
+MAX_CONCURRENT_REQUESTS = 16
 
-BASE_URL = "https://api-seller.ozon.ru"
-TIMEOUT_SEC = 30
+# name/offer_id товаров меняются редко: между запусками в те же сутки держим их в файле
+# и запрашиваем attributes только для новых product_id; кэш за прошлые дни не используем
+SKU_META_CACHE_PATH = ".sku_meta.cache.json"
 
-CLIENT_ID = os.getenv("OZON_CLIENT_ID")
-API_KEY = os.getenv("OZON_API_KEY")
-if not CLIENT_ID or not API_KEY:
-    raise RuntimeError("В .env не найдены OZON_CLIENT_ID и/или OZON_API_KEY")
+_NO_META: Dict[str, Any] = {}
 
-HEADERS = {
-    "Client-Id": CLIENT_ID,
-    "Api-Key": API_KEY,
-    "Content-Type": "application/json",
-    "Accept": "application/json",
-}
 
-
-def post_ozon(path: str, payload: Dict[str, Any], retries: int = 6) -> Any:
-    url = f"{BASE_URL}{path}"
-    backoff = 1.0
-
-    for _ in range(retries):
-        resp = requests.post(url, headers=HEADERS, json=payload, timeout=TIMEOUT_SEC)
-
-        if resp.status_code in (429, 500, 502, 503, 504):
-            time.sleep(backoff)
-            backoff = min(backoff * 2, 30)
-            continue
-
-        try:
-            data = resp.json()
-        except Exception:
-            data = resp.text
-
-        if not resp.ok:
-            raise RuntimeError(f"HTTP {resp.status_code} {path}: {data}")
-
-        return data
-
-    raise RuntimeError(f"Не удалось выполнить запрос {path} после {retries} попыток")
-
-
-def chunked(lst: List[Any], n: int) -> List[List[Any]]:
-    return [lst[i:i + n] for i in range(0, len(lst), n)]
-
-
-# --- 1) product_id ---
-def get_all_product_ids() -> List[str]:
-    product_ids: List[str] = []
-    last_id: str = ""
-
-    while True:
-        payload = {"filter": {"visibility": "ALL"}, "last_id": last_id, "limit": 1000}
-        data = post_ozon("/v3/product/list", payload)
-
-        result = (data or {}).get("result") or {}
-        items = result.get("items") or []
-        if not items:
-            break
-
-        for it in items:
-            pid = it.get("product_id")
-            if pid is not None:
-                product_ids.append(str(pid))
-
-        last_id = str(result.get("last_id") or "")
-        if not last_id:
-            break
-
-    return product_ids
-
-
-# --- 2) attributes -> sku + name + offer_id ---
-def extract_attributes_items(data: Any) -> List[Dict[str, Any]]:
-    # у тебя обычно {"result": [ ... ]}
-    if isinstance(data, dict):
-        r = data.get("result")
-        if isinstance(r, list):
-            return [x for x in r if isinstance(x, dict)]
-        if isinstance(r, dict) and isinstance(r.get("items"), list):
-            return [x for x in r["items"] if isinstance(x, dict)]
-        if isinstance(data.get("items"), list):
-            return [x for x in data["items"] if isinstance(x, dict)]
-    elif isinstance(data, list):
-        return [x for x in data if isinstance(x, dict)]
-    return []
+# --- 1) attributes -> sku + name + offer_id ---
+@lru_cache(maxsize=1 << 16)
+def _norm_str(s: str) -> Optional[int]:
+    # одни и те же sku приходят из info/list, attributes и т.д. — разбор строки кэшируем
+    if not s.isdigit():
+        return None
+    n = int(s)
+    return n if n > 0 else None
 
 
 def normalize_sku(v: Any) -> Optional[int]:
     if v is None:
         return None
-    s = str(v).strip()
-    if not s.isdigit():
-        return None
-    n = int(s)
-    return n if n > 0 else None
+    return _norm_str(str(v).strip())
 
 
 def extract_sku_from_item(it: Dict[str, Any]) -> Optional[int]:
@@ -115,118 +46,273 @@ def extract_sku_from_item(it: Dict[str, Any]) -> Optional[int]:
         n = normalize_sku(v[0])
         if n is not None:
             return n
+    # /v3/product/info/list: sku по схемам (старые fbo_sku/fbs_sku или sources[].sku)
+    for k in ("fbo_sku", "fbs_sku"):
+        n = normalize_sku(it.get(k))
+        if n is not None:
+            return n
+    sources = it.get("sources")
+    if isinstance(sources, list):
+        for src in sources:
+            if isinstance(src, dict):
+                n = normalize_sku(src.get("sku"))
+                if n is not None:
+                    return n
     return None
 
 
-def get_sku_meta_by_product_ids(product_ids: List[str]) -> Dict[int, Dict[str, Any]]:
+def sku_meta_entry(it: Dict[str, Any]) -> Tuple[Optional[str], Optional[int], Any, Any]:
+    # из записи товара нужны только product_id, sku и name/offer_id — остальное (атрибуты, картинки...) не храним
+    pid = it.get("id")
+    return (None if pid is None else str(pid)), extract_sku_from_item(it), it.get("name"), it.get("offer_id")
+
+
+def product_ids_hash(product_ids: List[str]) -> str:
+    return hashlib.sha1("\n".join(sorted(product_ids)).encode("utf-8")).hexdigest()
+
+
+def load_sku_meta_cache() -> Dict[str, Any]:
     """
-    Возвращает мапу:
-      sku_int -> {"name": ..., "offer_id": ...}
+    Кэш из SKU_META_CACHE_PATH:
+      {"date": ..., "product_ids_hash": ..., "products": {product_id: [sku, name, offer_id]}}
+    Если файла нет, он битый или записан не сегодня — пустой dict.
     """
-    sku_meta: Dict[int, Dict[str, Any]] = {}
+    try:
+        with open(SKU_META_CACHE_PATH, "rb") as f:
+            cached = json_loads(f.read())
+    except (OSError, ValueError):
+        return {}
+
+    if not isinstance(cached, dict) or cached.get("date") != date.today().isoformat():
+        return {}
+    if not isinstance(cached.get("products"), dict):
+        return {}
+    return cached
+
 
-    for batch in chunked(product_ids, 1000):
-        payload = {
-            "filter": {"product_id": batch, "visibility": "ALL"},
-            "limit": len(batch),
-            "sort_dir": "ASC",
-        }
-        data = post_ozon("/v4/product/info/attributes", payload)
-        items = extract_attributes_items(data)
-
-        for it in items:
-            sku = extract_sku_from_item(it)
+def save_sku_meta_cache(ids_hash: str, products: Dict[str, List[Any]]) -> None:
+    with open(SKU_META_CACHE_PATH, "wb") as f:
+        f.write(json_dumps({"date": date.today().isoformat(), "product_ids_hash": ids_hash, "products": products}))
+
+
+async def fetch_sku_meta_entries(
+    client: OzonClient,
+    product_ids: List[str],
+) -> AsyncIterator[Tuple[Optional[str], Optional[int], Any, Any]]:
+    """
+    sku_meta_entry по каждому товару. Сначала лёгкий /v3/product/info/list (id, name, offer_id, sku
+    без всех характеристик); тяжёлый /v4/product/info/attributes — только для товаров, у которых там
+    sku не нашёлся. Батчи запрашиваются параллельно и разбираются потоково (post_items).
+    """
+    resolved: Set[str] = set()
+    batches = prefetch_ordered(
+        client.post_items("/v3/product/info/list", {"product_id": batch}, sku_meta_entry, prefix="items.item")
+        for batch in chunked(product_ids, 1000)
+    )
+    async for entries in batches:
+        for entry in entries:
+            pid, sku = entry[0], entry[1]
             if sku is None:
                 continue
-            # name/offer_id берём отсюда (если в analytics тоже есть — не страшно)
-            sku_meta.setdefault(
-                sku,
-                {
-                    "name": it.get("name"),
-                    "offer_id": it.get("offer_id"),
-                },
-            )
+            if pid is not None:
+                resolved.add(pid)
+            yield entry
+
+    fallback_ids = [pid for pid in product_ids if pid not in resolved]
+    if not fallback_ids:
+        return
+    print(f"sku нет в /v3/product/info/list у {len(fallback_ids)} товаров — добираем через attributes")
+
+    batches = prefetch_ordered(
+        client.post_items("/v4/product/info/attributes", attributes_payload(batch), sku_meta_entry)
+        for batch in chunked(fallback_ids, 1000)
+    )
+    async for entries in batches:
+        for entry in entries:
+            yield entry
+
+
+async def get_sku_meta_by_product_ids(
+    client: OzonClient,
+    product_ids: List[str],
+    refresh: bool = False,
+) -> Dict[int, Dict[str, Any]]:
+    """
+    Возвращает мапу:
+      sku_int -> {"name": ..., "offer_id": ...}
+
+    Если набор product_ids тот же, что в кэше, и у всех есть sku, attributes не запрашиваем вовсе;
+    иначе — только для product_id, которых в кэше нет. Товары, для которых sku не нашёлся,
+    в кэш не пишем: их спрашиваем каждый запуск, пока sku не появится. refresh=True — кэш не читаем.
+    """
+    ids_hash = product_ids_hash(product_ids)
+    cache = {} if refresh else load_sku_meta_cache()
+    products: Dict[str, List[Any]] = cache.get("products") or {}
+    # записи без id к product_id не привязать — в кэш они не попадают
+    unbound: List[List[Any]] = []
+
+    missing = [pid for pid in product_ids if pid not in products]
+    if missing or cache.get("product_ids_hash") != ids_hash:
+        print(f"name/offer_id: из кэша {len(product_ids) - len(missing)}, запрашиваем {len(missing)}")
+
+        async for pid, sku, name, offer_id in fetch_sku_meta_entries(client, missing):
+            if pid is None:
+                unbound.append([sku, name, offer_id])
+            elif sku is not None:
+                products[pid] = [sku, name, offer_id]
+
+        # в кэше оставляем только текущие товары
+        products = {pid: products[pid] for pid in product_ids if pid in products}
+        save_sku_meta_cache(ids_hash, products)
+
+    sku_meta: Dict[int, Dict[str, Any]] = {}
+    entries = [products[pid] for pid in product_ids if pid in products] + unbound
+    for sku, name, offer_id in entries:
+        if sku is None:
+            continue
+        # setdefault оставляет первое встреченное name/offer_id, как и раньше
+        # (если в analytics тоже есть — не страшно)
+        sku_meta.setdefault(sku, {"name": name, "offer_id": offer_id})
 
     return sku_meta
 
 
-# --- 3) analytics/stocks ---
-def get_stocks_for_skus(skus: List[int]) -> List[Dict[str, Any]]:
-    # API: skus <= 100, мы даём 99
-    payload = {"skus": [str(s) for s in skus]}
-    data = post_ozon("/v1/analytics/stocks", payload)
+# --- 2) analytics/stocks ---
+async def get_stocks_for_skus(client: OzonClient, skus: List[int]) -> Tuple[List[int], List[Dict[str, Any]]]:
+    # API: skus <= 100, мы даём 99. Возвращаем и сам батч — чтобы знать, к каким sku пришёл ответ
+    payload = {"skus": list(map(str, skus))}
+    data = await client.post("/v1/analytics/stocks", payload)
     if isinstance(data, dict) and isinstance(data.get("items"), list):
-        return data["items"]
-    return []
-
-
-def compact_row(row: Dict[str, Any], fallback_meta: Dict[str, Any]) -> Dict[str, Any]:
-    available = int(row.get("available_stock_count") or 0)
-    valid = int(row.get("valid_stock_count") or 0)
-
-    return {
-        "sku": row.get("sku"),
-        "name": row.get("name") or fallback_meta.get("name"),
-        "offer_id": row.get("offer_id") or fallback_meta.get("offer_id"),
-        "warehouse_id": row.get("warehouse_id"),
-        "warehouse_name": row.get("warehouse_name"),
-        "cluster_id": row.get("cluster_id"),
-        "cluster_name": row.get("cluster_name"),
-        "stock": available + valid,
-    }
-
-
-# --- 4) финальный экспорт ---
-def export_stocks_compact(out_path: str = "stocks_compact.json", chunk_size: int = 99) -> None:
-    product_ids = get_all_product_ids()
-    print(f"Найдено товаров (product_id): {len(product_ids)}")
-
-    sku_meta = get_sku_meta_by_product_ids(product_ids)
-    skus = sorted(sku_meta.keys())
-    print(f"SKU найдено (уникальных): {len(skus)}")
-
-    # Пишем JSON-массив стримингом
-    with open(out_path, "w", encoding="utf-8") as f:
-        f.write("[\n")
+        return skus, data["items"]
+    return skus, []
+
+
+# --- 3) финальный экспорт ---
+async def export_stocks_compact(
+    out_path: Optional[str] = None,
+    chunk_size: int = 99,
+    refresh_meta: bool = False,
+    json_array: bool = False,
+) -> None:
+    """
+    По умолчанию пишет NDJSON (stocks_compact.jsonl): по объекту {sku, items} на строку,
+    такой файл читается построчно без загрузки целиком. json_array=True — прежний формат,
+    один JSON-массив (stocks_compact.json).
+    """
+    if out_path is None:
+        out_path = "stocks_compact.json" if json_array else "stocks_compact.jsonl"
+
+    async with OzonClient(retries=6, concurrency=MAX_CONCURRENT_REQUESTS) as client:
+        product_ids = await client.get_all_product_ids()
+        print(f"Найдено товаров (product_id): {len(product_ids)}")
+
+        sku_meta = await get_sku_meta_by_product_ids(client, product_ids, refresh=refresh_meta)
+        skus = sorted(sku_meta.keys())
+        print(f"SKU найдено (уникальных): {len(skus)}")
+
+        # Чанки остатков запрашиваются параллельно (окно PREFETCH_BATCHES), а в файл
+        # уходят по мере готовности в порядке sku — пока пишем один чанк, следующие уже в пути
+        stocks = prefetch_ordered(get_stocks_for_skus(client, sku_batch) for sku_batch in chunked(skus, chunk_size))
+        await write_stocks_compact(out_path, stocks, sku_meta, json_array=json_array)
+
+    print(f"✅ Готово: {out_path}")
+
+
+async def write_stocks_compact(
+    out_path: str,
+    stocks: AsyncIterator[Tuple[List[int], List[Dict[str, Any]]]],
+    sku_meta: Dict[int, Dict[str, Any]],
+    json_array: bool = False,
+) -> None:
+    # Пишем стримингом (NDJSON или JSON-массив): байты от json_dumps (orjson) сразу
+    # в буферизованный файл, по одному write на чанк
+    with open(out_path, "wb", buffering=1 << 20) as f:
+        if json_array:
+            f.write(b"[\n")
         first_sku_obj = True
+        idx = 0
 
-        for idx, sku_batch in enumerate(chunked(skus, chunk_size), start=1):
-            items = get_stocks_for_skus(sku_batch)
+        async for sku_batch, items in stocks:
+            idx += 1
             print(f"Чанк {idx}: SKU={len(sku_batch)} -> строк items={len(items)}")
 
-            # группируем строки по sku (внутри чанка)
-            grouped: Dict[int, List[Dict[str, Any]]] = {s: [] for s in sku_batch}
-
+            # строки ответа с числовым sku, отсортированные по sku. Сортировка стабильная —
+            # внутри одного sku склады идут в порядке ответа
+            keyed: List[Tuple[int, Dict[str, Any]]] = []
             for row in items:
                 sku_val = row.get("sku")
                 if sku_val is None:
                     continue
                 try:
-                    sku_int = int(sku_val)
+                    keyed.append((int(sku_val), row))
                 except Exception:
                     continue
-                if sku_int not in grouped:
-                    # на всякий случай
-                    grouped[sku_int] = []
-
-                grouped[sku_int].append(compact_row(row, sku_meta.get(sku_int, {})))
+            keyed.sort(key=itemgetter(0))
 
-            # записываем объекты {sku, items} по каждому sku из батча
+            # sku_batch тоже отсортирован: идём по нему и по группам строк двумя курсорами и пишем
+            # объекты {sku, items} сразу, без промежуточного dict sku -> строки
+            groups = groupby(keyed, key=itemgetter(0))
+            group = next(groups, None)
+            parts: List[bytes] = []
             for s in sku_batch:
-                obj = {
-                    "sku": str(s),
-                    "items": grouped.get(s, []),
-                }
-
-                if not first_sku_obj:
-                    f.write(",\n")
-                f.write("  " + json.dumps(obj, ensure_ascii=False))
-                first_sku_obj = False
-
-        f.write("\n]\n")
-
-    print(f"✅ Готово: {out_path}")
+                # строки по sku, которого нет в батче (на всякий случай), пропускаем
+                while group is not None and group[0] < s:
+                    group = next(groups, None)
+
+                rows: List[Dict[str, Any]] = []
+                if group is not None and group[0] == s:
+                    fb = sku_meta.get(s, _NO_META)
+                    fb_name = fb.get("name")
+                    fb_offer_id = fb.get("offer_id")
+
+                    for _, row in group[1]:
+                        row_get = row.get
+
+                        # по схеме OZON остатки — целые; int() нужен только если пришло что-то другое
+                        available = row_get("available_stock_count") or 0
+                        valid = row_get("valid_stock_count") or 0
+                        if type(available) is not int or type(valid) is not int:
+                            available = int(available)
+                            valid = int(valid)
+
+                        rows.append({
+                            "sku": row_get("sku"),
+                            "name": row_get("name") or fb_name,
+                            "offer_id": row_get("offer_id") or fb_offer_id,
+                            "warehouse_id": row_get("warehouse_id"),
+                            "warehouse_name": row_get("warehouse_name"),
+                            "cluster_id": row_get("cluster_id"),
+                            "cluster_name": row_get("cluster_name"),
+                            "stock": available + valid,
+                        })
+                    group = next(groups, None)
+
+                obj = json_dumps({"sku": str(s), "items": rows})
+                if json_array:
+                    parts.append(b"  " if first_sku_obj else b",\n  ")
+                    parts.append(obj)
+                    first_sku_obj = False
+                else:
+                    parts.append(obj)
+                    parts.append(b"\n")
+            f.write(b"".join(parts))
+
+        if json_array:
+            f.write(b"\n]\n")
 
 
 if __name__ == "__main__":
-    export_stocks_compact()
+    parser = argparse.ArgumentParser(description="Выгрузка остатков OZON по SKU в stocks_compact.jsonl")
+    parser.add_argument(
+        "--refresh-meta",
+        action="store_true",
+        help=f"заново запросить name/offer_id по всем товарам, не глядя в {SKU_META_CACHE_PATH}",
+    )
+    parser.add_argument(
+        "--json-array",
+        action="store_true",
+        help="писать один JSON-массив в stocks_compact.json (как раньше) вместо NDJSON",
+    )
+    args = parser.parse_args()
+
+    asyncio.run(export_stocks_compact(refresh_meta=args.refresh_meta, json_array=args.json_array))